@@ -1,9 +1,54 @@
-import json
+import asyncio
+import io
+import anyio
+import msgspec
 from fastapi import FastAPI, HTTPException
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, Field
 import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
 from botocore.exceptions import ClientError, NoCredentialsError
-from typing import Dict, List, Any, Optional
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache, partial
+from itertools import islice
+from msgspec import UNSET, UnsetType
+from typing import Callable, Dict, Iterable, Iterator, List, Any, Optional, Tuple, Union
+
+# --- Request Limits ---
+# Caps how many /transform requests read from S3 at once, so a burst of callers
+# cannot exhaust the worker threads or trigger S3 throttling.
+MAX_CONCURRENT_TRANSFORMS = 4
+_transform_slots = asyncio.Semaphore(MAX_CONCURRENT_TRANSFORMS)
+
+# --- S3 Client Settings ---
+# Object reads are network bound, so they are fanned out across a thread pool.
+S3_MAX_WORKERS = 32
+# Files read ahead of the one currently being streamed out, bounding memory per request
+S3_READ_AHEAD = 2 * S3_MAX_WORKERS
+# Files at or above this size are fetched as parallel ranged GETs, smaller ones
+# with a single GET. Either way the file is parsed from memory.
+LARGE_FILE_MIN_BYTES = 8 * 1024 * 1024
+# Ranged GETs per large file. Each runs on its own connection while the file
+# worker waits, so one request can hold S3_MAX_WORKERS * S3_TRANSFER_CONCURRENCY
+# connections at once.
+S3_TRANSFER_CONCURRENCY = 2
+S3_SELECT_EXPRESSION = "SELECT s._airbyte_data FROM s3object s"
+# The connection pool belongs to the client, which is cached per credentials and
+# shared by every concurrent request using them. It must cover every connection
+# those requests can hold, otherwise urllib3 opens extra connections and
+# discards them instead of keeping them warm.
+S3_CLIENT_CONFIG = Config(
+    max_pool_connections=MAX_CONCURRENT_TRANSFORMS * S3_MAX_WORKERS * S3_TRANSFER_CONCURRENCY,
+    retries={'mode': 'adaptive'},
+    tcp_keepalive=True
+)
+S3_TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=LARGE_FILE_MIN_BYTES,
+    multipart_chunksize=LARGE_FILE_MIN_BYTES,
+    max_concurrency=S3_TRANSFER_CONCURRENCY
+)
 
 # --- Pydantic Models for API Request Body ---
 # This defines the structure and validates the input you send to the API.
@@ -12,127 +57,179 @@ class S3Config(BaseModel):
     aws_secret_access_key: str = Field(..., example="YOUR_AWS_SECRET_ACCESS_KEY")
     s3_bucket_name: str = Field(..., example="your-airbyte-output-bucket")
     s3_bucket_path: str = Field(..., example="vapormedia", description="The base path inside the bucket where stream folders are located.")
+    use_s3_select: bool = Field(False, description="Project `_airbyte_data` server-side with S3 Select. Only works on buckets whose account still has S3 Select access.")
+
+# --- Record Types ---
+# Known streams are decoded straight from the jsonl bytes into these structs and
+# re-encoded from the output structs, so no intermediate dict is built per record.
+# Fields are typed Any because Airbyte passes the GitLab values through as-is.
+# Decoded JSON can never form reference cycles, so GC tracking is turned off.
+class CommitIn(msgspec.Struct, gc=False):
+    id: Any = None
+    short_id: Any = None
+    title: Any = None
+    message: Any = None
+    author_name: Any = None
+    author_email: Any = None
+    committer_name: Any = None
+    committer_email: Any = None
+    authored_date: Any = None
+    created_at: Any = None
+    committed_date: Any = None
+    web_url: Any = None
+
+class ProjectIn(msgspec.Struct, gc=False):
+    id: Any = None
+    name: Any = None
+    path_with_namespace: Any = None
+    web_url: Any = None
+    namespace: Any = None
+    created_at: Any = None
+    last_activity_at: Any = None
+    updated_at: Any = None
+    visibility: Any = None
+    description_html: Any = None
+    description: Any = ""
+
+class UserIn(msgspec.Struct, gc=False):
+    id: Any = None
+    username: Any = None
+    name: Any = None
+    web_url: Any = None
+    avatar_url: Any = None
+
+# A jsonl line is either wrapped in the Airbyte envelope or is the record itself, so
+# each line type is the record plus the optional envelope field. UNSET means no wrapper.
+class CommitLine(CommitIn, gc=False):
+    airbyte_data: Union[CommitIn, None, UnsetType] = msgspec.field(default=UNSET, name="_airbyte_data")
+
+class ProjectLine(ProjectIn, gc=False):
+    airbyte_data: Union[ProjectIn, None, UnsetType] = msgspec.field(default=UNSET, name="_airbyte_data")
+
+class UserLine(UserIn, gc=False):
+    airbyte_data: Union[UserIn, None, UnsetType] = msgspec.field(default=UNSET, name="_airbyte_data")
+
+class Person(msgspec.Struct, gc=False):
+    name: Any
+    email: Any
+
+class CommitOut(msgspec.Struct, gc=False):
+    id: Any
+    short_id: Any
+    title: Any
+    message: Any
+    author: Person
+    committer: Person
+    created_at: Any
+    committed_at: Any
+    url: Any
+
+class ProjectOut(msgspec.Struct, gc=False):
+    id: Any
+    name: Any
+    path_with_namespace: Any
+    url: Any
+    namespace: Any
+    created_at: Any
+    updated_at: Any
+    visibility: Any
+    description: Any
+
+class UserOut(msgspec.Struct, gc=False):
+    id: Any
+    username: Any
+    name: Any
+    url: Any
+    avatar_url: Any
 
 # --- Transformation Functions ---
-def transform_commits(commits_data: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
-    """Transform commits data according to the simplified mapping."""
-    if not commits_data:
-        return []
-    
-    transformed_commits = []
-    
-    for commit in commits_data:
-        if not isinstance(commit, dict):
-            continue
-            
-        transformed_commit = {
-            "id": commit.get("id"),
-            "short_id": commit.get("short_id"),
-            "title": commit.get("title"),
-            "message": commit.get("message"),
-            "author": {
-                "name": commit.get("author_name"),
-                "email": commit.get("author_email")
-            },
-            "committer": {
-                "name": commit.get("committer_name"),
-                "email": commit.get("committer_email")
-            },
-            "created_at": commit.get("authored_date") or commit.get("created_at"),
-            "committed_at": commit.get("committed_date"),
-            "url": commit.get("web_url")
-        }
-        transformed_commits.append(transformed_commit)
-    
-    return transformed_commits
+def transform_commit(commit: CommitIn) -> CommitOut:
+    """Transform a single commit record according to the simplified mapping."""
+    return CommitOut(
+        id=commit.id,
+        short_id=commit.short_id,
+        title=commit.title,
+        message=commit.message,
+        author=Person(name=commit.author_name, email=commit.author_email),
+        committer=Person(name=commit.committer_name, email=commit.committer_email),
+        created_at=commit.authored_date or commit.created_at,
+        committed_at=commit.committed_date,
+        url=commit.web_url
+    )
 
-def transform_projects(projects_data: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
-    """Transform projects data according to the simplified mapping."""
-    if not projects_data:
-        return []
-    
-    transformed_projects = []
-    
-    for project in projects_data:
-        if not isinstance(project, dict):
-            continue
-            
-        namespace_name = None
-        if isinstance(project.get("namespace"), dict):
-            namespace_name = project["namespace"].get("name")
-        elif isinstance(project.get("namespace"), str):
-            namespace_name = project.get("namespace")
-        
-        transformed_project = {
-            "id": project.get("id"),
-            "name": project.get("name"),
-            "path_with_namespace": project.get("path_with_namespace"),
-            "url": project.get("web_url"),
-            "namespace": namespace_name,
-            "created_at": project.get("created_at"),
-            "updated_at": project.get("last_activity_at") or project.get("updated_at"),
-            "visibility": project.get("visibility"),
-            "description": project.get("description_html") or project.get("description", "")
-        }
-        transformed_projects.append(transformed_project)
+def transform_project(project: ProjectIn) -> ProjectOut:
+    """Transform a single project record according to the simplified mapping."""
+    namespace = project.namespace
+    if isinstance(namespace, dict):
+        namespace = namespace.get("name")
+    elif not isinstance(namespace, str):
+        namespace = None
     
-    return transformed_projects
+    return ProjectOut(
+        id=project.id,
+        name=project.name,
+        path_with_namespace=project.path_with_namespace,
+        url=project.web_url,
+        namespace=namespace,
+        created_at=project.created_at,
+        updated_at=project.last_activity_at or project.updated_at,
+        visibility=project.visibility,
+        description=project.description_html or project.description
+    )
 
-def transform_users(users_data: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
-    """Transform users data according to the simplified mapping and remove duplicates."""
-    if not users_data:
-        return []
-    
+def transform_user(user: UserIn) -> UserOut:
+    """Transform a single user record according to the simplified mapping."""
+    return UserOut(
+        id=user.id,
+        username=user.username,
+        name=user.name,
+        url=user.web_url,
+        avatar_url=user.avatar_url
+    )
+
+# Per-record transform for each known stream, applied while the files are parsed
+TRANSFORMERS: Dict[str, Callable[[Any], msgspec.Struct]] = {
+    "commits": transform_commit,
+    "projects": transform_project,
+    "users": transform_user,
+}
+
+def _unique_users() -> Callable[[List[UserOut]], List[UserOut]]:
+    """Build a filter that drops users without an id or whose id was already seen, first occurrence wins."""
     seen_ids = set()
-    transformed_users = []
+    mark_seen = seen_ids.add
     
-    for user in users_data:
-        if not isinstance(user, dict):
-            continue
-            
-        user_id = user.get("id")
-        if user_id and user_id not in seen_ids:
-            seen_ids.add(user_id)
-            transformed_user = {
-                "id": user_id,
-                "username": user.get("username"),
-                "name": user.get("name"),
-                "url": user.get("web_url"),
-                "avatar_url": user.get("avatar_url")
-            }
-            transformed_users.append(transformed_user)
+    def keep_unique(users: List[UserOut]) -> List[UserOut]:
+        unique_users = []
+        keep_user = unique_users.append
+        for user in users:
+            user_id = user.id
+            if user_id and user_id not in seen_ids:
+                mark_seen(user_id)
+                keep_user(user)
+        return unique_users
     
-    return transformed_users
+    return keep_unique
 
-def apply_transformations(data: Dict[str, List[Dict[str, Any]]]) -> Dict[str, List[Dict[str, Any]]]:
-    """Apply transformations to all supported data types."""
-    if not data:
-        return {}
-    
-    transformed_data = {}
-    
-    for stream_name, stream_data in data.items():
-        if not isinstance(stream_data, list):
-            print(f"Warning: Stream '{stream_name}' data is not a list, skipping transformation")
-            transformed_data[stream_name] = stream_data
-            continue
-            
-        try:
-            if stream_name == "commits":
-                transformed_data[stream_name] = transform_commits(stream_data)
-            elif stream_name == "projects":
-                transformed_data[stream_name] = transform_projects(stream_data)
-            elif stream_name == "users":
-                transformed_data[stream_name] = transform_users(stream_data)
-            else:
-                # For unknown stream types, pass through without transformation
-                transformed_data[stream_name] = stream_data
-        except Exception as e:
-            print(f"Warning: Failed to transform stream '{stream_name}': {e}")
-            # On transformation failure, keep original data
-            transformed_data[stream_name] = stream_data
-    
-    return transformed_data
+# Per-stream filter factories. A fresh filter is built for each stream and sees every
+# file's transformed records in order, so it can keep state across files.
+STREAM_FILTERS: Dict[str, Callable[[], Callable[[List[Any]], List[Any]]]] = {
+    "users": _unique_users,
+}
+
+# Typed jsonl line decoders for the streams in TRANSFORMERS
+LINE_DECODERS: Dict[str, msgspec.json.Decoder] = {
+    "commits": msgspec.json.Decoder(CommitLine),
+    "projects": msgspec.json.Decoder(ProjectLine),
+    "users": msgspec.json.Decoder(UserLine),
+}
+
+# Untyped decoder for the records of unknown streams. Unlike orjson it keeps
+# integers wider than 64 bits exact.
+_raw_decoder = msgspec.json.Decoder()
+
+# Encodes both the output structs and the plain dicts of unknown streams
+_record_encoder = msgspec.json.Encoder()
 
 # --- FastAPI Application ---
 app = FastAPI(
@@ -140,19 +237,177 @@ app = FastAPI(
     description="An API to fetch Airbyte JSONL outputs from S3, transform them into a single JSON object."
 )
 
-def fetch_and_transform_from_s3(config: S3Config) -> dict:
+def _list_stream_keys(s3_client, bucket_name: str, prefix: str) -> List[Tuple[str, int]]:
+    """Return every .jsonl key under a stream prefix with its size, following all list_objects_v2 pages."""
+    # A single list_objects_v2 call stops at 1000 keys, so walk every page
+    paginator = s3_client.get_paginator('list_objects_v2')
+    return [
+        (obj['Key'], obj['Size'])
+        for page in paginator.paginate(Bucket=bucket_name, Prefix=prefix)
+        for obj in page.get('Contents', [])
+        if obj['Key'].endswith('.jsonl')
+    ]
+
+def _iter_select_lines(payload) -> Iterator[bytes]:
+    """Yield the complete lines of an S3 Select event stream."""
+    # Payload chunks are not aligned to records, so keep the partial tail line buffered
+    pending = bytearray()
+    for event in payload:
+        if 'Records' not in event:
+            continue
+        pending += event['Records']['Payload']
+        end = pending.rfind(b'\n')
+        if end == -1:
+            continue
+        yield from bytes(pending[:end]).split(b'\n')
+        del pending[:end + 1]
+    
+    if pending.strip():
+        yield bytes(pending)
+
+def _select_jsonl_records(s3_client, bucket_name: str, s3_key: str, stream_name: str) -> Optional[List[Any]]:
+    """
+    Read a single .jsonl object through S3 Select so only `_airbyte_data` is sent back.
+    Returns None if any line has no `_airbyte_data` wrapper, since the full record is needed then.
+    """
+    response = s3_client.select_object_content(
+        Bucket=bucket_name,
+        Key=s3_key,
+        Expression=S3_SELECT_EXPRESSION,
+        ExpressionType='SQL',
+        InputSerialization={'JSON': {'Type': 'LINES'}},
+        OutputSerialization={'JSON': {'RecordDelimiter': '\n'}}
+    )
+    
+    decoder = LINE_DECODERS.get(stream_name)
+    transform = TRANSFORMERS.get(stream_name)
+    records = []
+    try:
+        for line in _iter_select_lines(response['Payload']):
+            if not line:
+                continue
+            if decoder is None:
+                record = _raw_decoder.decode(line).get('_airbyte_data')
+            else:
+                try:
+                    record = decoder.decode(line).airbyte_data
+                except msgspec.ValidationError:
+                    # `_airbyte_data` is not an object, nothing to transform
+                    continue
+            # Lines without the wrapper come back as an empty object
+            if record is None or record is UNSET:
+                return None
+            records.append(record if transform is None else transform(record))
+    finally:
+        # Stopping early leaves the event stream open, so close it either way
+        response['Payload'].close()
+    return records
+
+def _parse_jsonl_lines(lines: Iterable[bytes], stream_name: str) -> List[Any]:
     """
-    Connects to S3, finds stream directories, reads all jsonl files,
-    and consolidates them into a single dictionary.
+    Parse jsonl lines into records without the Airbyte metadata, transforming
+    each record as soon as it is parsed so the raw form is never kept.
+    """
+    # The file's records are collected locally and handed back as one list, with the
+    # bound methods used per line hoisted out of the loops
+    records = []
+    append = records.append
+    decoder = LINE_DECODERS.get(stream_name)
+    # Each line in a jsonl file is a separate JSON object
+    if decoder is None:
+        # For unknown stream types, pass through without transformation
+        loads = _raw_decoder.decode
+        for line in lines:
+            if line:
+                record = loads(line)
+                # We only care about the actual data, not the Airbyte metadata.
+                # If there's no _airbyte_data wrapper, use the entire record.
+                append(record['_airbyte_data'] if '_airbyte_data' in record else record)
+        return records
+    
+    decode = decoder.decode
+    transform = TRANSFORMERS[stream_name]
+    for line in lines:
+        if line:
+            try:
+                line_record = decode(line)
+            except msgspec.ValidationError:
+                # Not an object, nothing to transform
+                continue
+            record = line_record if line_record.airbyte_data is UNSET else line_record.airbyte_data
+            if record is not None:
+                append(transform(record))
+    return records
+
+def _iter_jsonl_lines(body: bytes) -> Iterator[memoryview]:
+    """Yield each line of a jsonl body as a memoryview slice, without copying it or building a list of lines."""
+    view = memoryview(body)
+    end = len(body)
+    pos = 0
+    while pos < end:
+        newline = body.find(b'\n', pos)
+        if newline == -1:
+            newline = end
+        yield view[pos:newline]
+        pos = newline + 1
+
+def _parse_jsonl_body(body: bytes, stream_name: str) -> List[Any]:
+    """Parse and transform a whole jsonl file held in memory."""
+    return _parse_jsonl_lines(_iter_jsonl_lines(body), stream_name)
+
+def _read_jsonl_records(
+    s3_client,
+    bucket_name: str,
+    s3_key: str,
+    size: int,
+    stream_name: str,
+    use_s3_select: bool = False
+) -> List[Any]:
+    """Download a single .jsonl object and return its transformed records."""
+    print(f"  - Reading file: {s3_key}")
+    if use_s3_select:
+        try:
+            records = _select_jsonl_records(s3_client, bucket_name, s3_key, stream_name)
+        except ClientError as e:
+            # e.g. MethodNotAllowed on accounts without S3 Select, or a record over its 1 MB limit
+            print(f"    - S3 Select failed for {s3_key}: {e}, reading the whole file instead")
+        else:
+            if records is not None:
+                return records
+            print(f"    - {s3_key} has records without '_airbyte_data', reading the whole file instead")
+    
+    if size < LARGE_FILE_MIN_BYTES:
+        file_obj = s3_client.get_object(Bucket=bucket_name, Key=s3_key)
+        return _parse_jsonl_body(file_obj['Body'].read(), stream_name)
+    
+    # Fetch the parts of the file with parallel ranged GETs
+    buffer = io.BytesIO()
+    s3_client.download_fileobj(bucket_name, s3_key, buffer, Config=S3_TRANSFER_CONFIG)
+    return _parse_jsonl_body(buffer.getvalue(), stream_name)
+
+@lru_cache(maxsize=8)
+def _get_s3_client(aws_access_key_id: str, aws_secret_access_key: str):
+    """
+    Return a boto3 S3 client for the given credentials, reusing it across requests.
+    Building a client loads the service model and starts a cold connection pool,
+    so only the least recently used credentials are ever rebuilt. The pool is per
+    client, so it is sized for all concurrent requests, see S3_CLIENT_CONFIG.
     """
     print("Initializing S3 client...")
+    return boto3.client(
+        's3',
+        aws_access_key_id=aws_access_key_id,
+        aws_secret_access_key=aws_secret_access_key,
+        # region_name="us-east-1"
+        config=S3_CLIENT_CONFIG
+    )
+
+def list_stream_files(s3_client, config: S3Config) -> Dict[str, List[Tuple[str, int]]]:
+    """
+    Finds the stream directories under the configured path and lists
+    the jsonl files in each as (key, size) pairs, keyed by stream name.
+    """
     try:
-        s3_client = boto3.client(
-            's3',
-            aws_access_key_id=config.aws_access_key_id,
-            aws_secret_access_key=config.aws_secret_access_key
-            # region_name="us-east-1"
-        )
         # Use list_objects_v2 to find top-level "directories" which are the streams
         paginator = s3_client.get_paginator('list_objects_v2')
         pages = paginator.paginate(Bucket=config.s3_bucket_name, Prefix=f"{config.s3_bucket_path}/", Delimiter='/')
@@ -178,47 +433,116 @@ def fetch_and_transform_from_s3(config: S3Config) -> dict:
     if not stream_prefixes:
         raise HTTPException(status_code=404, detail=f"No stream directories found under the path '{config.s3_bucket_path}/' in bucket '{config.s3_bucket_name}'.")
 
-    consolidated_data = {}
+    stream_files = {}
     print(f"Found stream directories: {[prefix.split('/')[-2] for prefix in stream_prefixes]}")
 
-    # Iterate through each stream directory
-    for prefix in stream_prefixes:
-        stream_name = prefix.split('/')[-2] # Extract stream name (e.g., 'commits')
-        consolidated_data[stream_name] = []
-        
-        print(f"Processing stream: {stream_name}")
-        
-        # Find all objects within that stream's prefix
-        objects_in_stream = s3_client.list_objects_v2(Bucket=config.s3_bucket_name, Prefix=prefix)
-        
-        if 'Contents' not in objects_in_stream:
-            print(f"  - No files found in '{prefix}'. Skipping.")
-            continue
+    # Listing one prefix does not depend on another, so the streams are listed in parallel
+    with ThreadPoolExecutor(max_workers=min(S3_MAX_WORKERS, len(stream_prefixes))) as executor:
+        stream_keys = {
+            prefix: executor.submit(_list_stream_keys, s3_client, config.s3_bucket_name, prefix)
+            for prefix in stream_prefixes
+        }
+        for prefix, future in stream_keys.items():
+            stream_name = prefix.split('/')[-2] # Extract stream name (e.g., 'commits')
+            stream_files[stream_name] = future.result()
+            if not stream_files[stream_name]:
+                print(f"  - No files found in '{prefix}'. Skipping.")
 
-        # Process each.jsonl file
-        for obj in objects_in_stream['Contents']:
-            s3_key = obj['Key']
-            if s3_key.endswith('.jsonl'):
-                print(f"  - Reading file: {s3_key}")
-                try:
-                    file_obj = s3_client.get_object(Bucket=config.s3_bucket_name, Key=s3_key)
-                    # Fix: Access the Body and then read from it
-                    file_content = file_obj['Body'].read().decode('utf-8')
-                    
-                    # Each line in a jsonl file is a separate JSON object
-                    for line in file_content.strip().split('\n'):
-                        if line:
-                            record = json.loads(line)
-                            # We only care about the actual data, not the Airbyte metadata
-                            if '_airbyte_data' in record:
-                                consolidated_data[stream_name].append(record['_airbyte_data'])
-                            else:
-                                # If there's no _airbyte_data wrapper, use the entire record
-                                consolidated_data[stream_name].append(record)
-                except Exception as e:
-                    print(f"    - Failed to process file {s3_key}: {e}")
-
-    return consolidated_data
+    return stream_files
+
+def _iter_file_records(
+    executor: ThreadPoolExecutor,
+    s3_client,
+    config: S3Config,
+    stream_name: str,
+    s3_objects: List[Tuple[str, int]]
+) -> Iterator[List[Any]]:
+    """
+    Read files concurrently and yield each file's transformed records in listing order.
+    At most S3_READ_AHEAD files are in flight or buffered at any time.
+    """
+    read_file = partial(
+        _read_jsonl_records, s3_client, config.s3_bucket_name,
+        stream_name=stream_name, use_s3_select=config.use_s3_select
+    )
+    objects = iter(s3_objects)
+    pending = deque(
+        (s3_key, executor.submit(read_file, s3_key, size))
+        for s3_key, size in islice(objects, S3_READ_AHEAD)
+    )
+    try:
+        while pending:
+            s3_key, future = pending.popleft()
+            next_object = next(objects, None)
+            if next_object is not None:
+                pending.append((next_object[0], executor.submit(read_file, *next_object)))
+            try:
+                yield future.result()
+            except Exception as e:
+                print(f"    - Failed to process file {s3_key}: {e}")
+    finally:
+        # Stopped early, drop the reads that have not started yet
+        for _, future in pending:
+            future.cancel()
+
+def iter_transformed_json(
+    s3_client,
+    config: S3Config,
+    stream_files: Dict[str, List[Tuple[str, int]]],
+    executor: ThreadPoolExecutor
+) -> Iterator[bytes]:
+    """
+    Yields the consolidated JSON object piece by piece. Records are transformed
+    as each file is parsed and encoded as soon as the file is read, so only a
+    window of files is held in memory instead of every record in the bucket.
+    Files are read on `executor`, which is shut down without waiting once the
+    generator finishes or is closed; the caller waits for it.
+    """
+    yield b'{'
+    try:
+        for stream_index, (stream_name, s3_objects) in enumerate(stream_files.items()):
+            print(f"Processing stream: {stream_name}")
+            yield (b',' if stream_index else b'') + _record_encoder.encode(stream_name) + b':['
+            
+            make_filter = STREAM_FILTERS.get(stream_name)
+            keep_records = make_filter() if make_filter is not None else None
+            first_chunk = True
+            for records in _iter_file_records(executor, s3_client, config, stream_name, s3_objects):
+                if keep_records is not None:
+                    records = keep_records(records)
+                if not records:
+                    continue
+                chunk = b','.join(map(_record_encoder.encode, records))
+                yield chunk if first_chunk else b',' + chunk
+                first_chunk = False
+            
+            yield b']'
+    finally:
+        # The generator can be closed early, e.g. when the client disconnects, and that may
+        # happen on the event loop thread. Do not wait for queued reads there.
+        executor.shutdown(wait=False, cancel_futures=True)
+    yield b'}'
+
+class _TransformStreamingResponse(StreamingResponse):
+    """
+    StreamingResponse that frees a /transform slot once the body is sent or the
+    client goes away, and only after the request's S3 reads have stopped.
+    """
+    def __init__(self, content, executor: ThreadPoolExecutor, **kwargs):
+        super().__init__(content, **kwargs)
+        self.executor = executor
+    
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            try:
+                # Drop queued reads and wait for the running ones in a worker thread. Shielded
+                # so a disconnect cancelling this call cannot skip the wait.
+                with anyio.CancelScope(shield=True):
+                    await anyio.to_thread.run_sync(partial(self.executor.shutdown, wait=True, cancel_futures=True))
+            finally:
+                _transform_slots.release()
 
 # --- API Endpoint ---
 @app.post("/transform", summary="Transform S3 JSONL to Single JSON")
@@ -229,16 +553,32 @@ async def create_transformation(config: S3Config):
     read all `.jsonl` files within them, and return a single consolidated
     JSON object.
     """
+    # Held until the whole response has been streamed, see _TransformStreamingResponse
+    await _transform_slots.acquire()
     try:
-        raw_data = fetch_and_transform_from_s3(config)
-        transformed_json = apply_transformations(raw_data)
-        return transformed_json
-    except HTTPException as e:
-        # Re-raise HTTPExceptions to let FastAPI handle the response
-        raise e
-    except Exception as e:
-        # Catch any other unexpected errors
-        raise HTTPException(status_code=500, detail=f"An internal error occurred: {str(e)}")
+        try:
+            # Client setup and listing are blocking, so run them in a worker thread to keep
+            # the event loop free. Listing errors are raised here, before the response starts.
+            s3_client = await anyio.to_thread.run_sync(_get_s3_client, config.aws_access_key_id, config.aws_secret_access_key)
+            stream_files = await anyio.to_thread.run_sync(list_stream_files, s3_client, config)
+        except HTTPException as e:
+            # Re-raise HTTPExceptions to let FastAPI handle the response
+            raise e
+        except Exception as e:
+            # Catch any other unexpected errors
+            raise HTTPException(status_code=500, detail=f"An internal error occurred: {str(e)}")
+    except BaseException:
+        _transform_slots.release()
+        raise
+    
+    # The body is produced by a sync generator, which Starlette iterates in its thread pool.
+    # The response owns the executor so it can wait for the reads before freeing the slot.
+    executor = ThreadPoolExecutor(max_workers=S3_MAX_WORKERS)
+    return _TransformStreamingResponse(
+        iter_transformed_json(s3_client, config, stream_files, executor),
+        executor,
+        media_type="application/json"
+    )
 
 @app.get("/", summary="Health Check")
 def read_root():